@@ -2,11 +2,43 @@
 
 import sys
 import os
+import csv
+import functools
+import hashlib
+import logging
+import logging.handlers
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
 import cv2
 import numpy as np
-import pandas as pd
 import requests
+import torch
+import torch.nn.functional as F
 from ultralytics import YOLO
+from ultralytics.cfg import DEFAULT_CFG_DICT
+from ultralytics.engine.results import Boxes
+from ultralytics.trackers.byte_tracker import BYTETracker
+from ultralytics.utils import YAML, IterableSimpleNamespace, ops
+from ultralytics.utils.nms import non_max_suppression
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; kernels then run as plain Python
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+try:
+    import av
+    from av.codec.hwaccel import HWAccel, hwdevices_available
+    _av_import_error = None
+except ImportError as e:  # PyAV is optional; fall back to cv2.VideoCapture
+    av = None
+    _av_import_error = e
 
 # ========= CONFIG =========
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,9 +50,58 @@ MODEL_PATH = os.path.join(MODEL_DIR, "best.pt")
 # Tracker YAML (small) can be committed to your repo
 TRACKER_PATH = os.path.join(BASE_DIR, "models", "bytetrack_whales.yaml")
 
+# TensorRT engines are hardware-specific, so they are cached per weights hash,
+# GPU arch, TensorRT version and input size. Set BELUGA_TENSORRT=0 to force
+# best.pt.
+ENGINE_DIR = os.environ.get("BELUGA_ENGINE_DIR", os.path.join(MODEL_DIR, "engines"))
+USE_TENSORRT = os.environ.get("BELUGA_TENSORRT", "1") != "0"
+IMGSZ = 640
+
+# Opt-in INT8 engine. It is calibrated on frames sampled from the first video
+# processed with BELUGA_INT8=1 and then reused for every later video; delete
+# the *_int8.engine file to recalibrate on a more representative clip. Check
+# accuracy against the FP16 engine before enabling it.
+USE_INT8 = os.environ.get("BELUGA_INT8", "0") == "1"
+CALIB_FRAMES = int(os.environ.get("BELUGA_CALIB_FRAMES", "500"))
+CALIB_STRIDE = 5  # take every Nth frame so calibration covers more of the clip
+TRACK_CONF = 0.1  # detection threshold model.track() would use
+
+# Frames per model.track() call; the engine is built with this as its max batch
+BATCH_SIZE = int(os.environ.get("BELUGA_BATCH_SIZE", "4"))
+
+# Annotated frames waiting for the encoder thread; bounds memory and latency
+WRITE_QUEUE_SIZE = 2 * BATCH_SIZE
+
+# Output is H.264 (NVENC on GPU hosts, else libx264) through an ffmpeg pipe;
+# without an ffmpeg binary it falls back to OpenCV's mp4v writer.
+FFMPEG_BIN = os.environ.get("BELUGA_FFMPEG", "ffmpeg")
+NVENC_ARGS = ["-c:v", "h264_nvenc", "-preset", "p4", "-cq", "23"]
+X264_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23"]
+
+# Frames decoded ahead of the tracking loop on a reader thread
+PREFETCH_FRAMES = 2 * BATCH_SIZE
+
 CLASS_NAMES = ["Adult", "Calf"]
 SMOOTHING_ALPHA = 0.30
+MAX_TRACKS = 4096  # slots in the smoothing hash table (power of two)
+SMOOTHING_TTL = 300  # frames a track's last box is kept after it was last seen
+EMPTY_KEY = -1
+
+# Output video height (e.g. 720). Frames are downscaled before overlays are
+# drawn and encoded; CSV coordinates stay in source resolution. 0 = source.
+OUTPUT_HEIGHT = int(os.environ.get("BELUGA_OUTPUT_HEIGHT", "0"))
+
+# Opt-in adaptive inference: frames whose downscaled grayscale barely differs
+# from the last inferred frame redraw its boxes, at most MAX_SKIP in a row.
+# Skipped frames get no CSV rows, and ByteTrack only sees inferred frames, so
+# its track_buffer then spans up to (MAX_SKIP + 1)x as many video frames.
+# The default 0 runs YOLO on every frame.
+MAX_SKIP = int(os.environ.get("BELUGA_MAX_SKIP", "0"))
+SKIP_DIFF_THRESH = float(os.environ.get("BELUGA_SKIP_DIFF", "2.0"))
+DIFF_SIZE = (80, 45)
 CSV_EVERY_N_FRAMES = 100
+CSV_COLUMNS = ["Frame", "Time (s)", "Track_ID", "Class",
+               "X1", "Y1", "X2", "Y2", "Behavior", "Conf"]
 
 # === Colors (BGR) ===
 ADULT_GREEN = (147, 205, 108)
@@ -33,9 +114,144 @@ PAD_X      = 8
 PAD_Y      = 6
 LABEL_ALPHA = 0.85
 
+# Per-frame progress lines are buffered and written in batches, at least
+# every LOG_FLUSH_SECS; status lines are written immediately (after any
+# buffered progress) and warnings and errors go to stderr.
+LOG_BUFFER = 1000
+LOG_FLUSH_SECS = 5.0
+
+logger = logging.getLogger("beluga_track_server")
+
 # ========= HELPERS =========
-def smooth(old, new, alpha=SMOOTHING_ALPHA):
-    return int(alpha * new + (1 - alpha) * old)
+class ProgressBufferHandler(logging.handlers.MemoryHandler):
+    """Hold records logged with extra={"buffered": True}; anything else flushes.
+
+    The buffer is also flushed once its oldest record is flush_secs old, so
+    progress keeps showing up while a long video is processed.
+    """
+
+    def __init__(self, capacity, flush_secs, target):
+        super().__init__(capacity, target=target)
+        self.flush_secs = flush_secs
+
+    def shouldFlush(self, record):
+        return (
+            super().shouldFlush(record)
+            or not getattr(record, "buffered", False)
+            or record.created - self.buffer[0].created >= self.flush_secs
+        )
+
+def setup_logging():
+    """Route INFO to stdout, buffering progress lines, and WARNING+ to stderr."""
+    stdout = logging.StreamHandler(sys.stdout)
+    stdout.addFilter(lambda record: record.levelno < logging.WARNING)
+    buffered = ProgressBufferHandler(LOG_BUFFER, LOG_FLUSH_SECS, target=stdout)
+    stderr = logging.StreamHandler(sys.stderr)
+    stderr.setLevel(logging.WARNING)
+    logger.addHandler(buffered)
+    logger.addHandler(stderr)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+@njit(cache=True)
+def ema_update(table, rows, fresh, xyxy, alpha):
+    """EMA-blend each box into its table row; xyxy receives the smoothed boxes."""
+    for i in range(rows.shape[0]):
+        r = rows[i]
+        for j in range(4):
+            if not fresh[i]:
+                xyxy[i, j] = int(alpha * xyxy[i, j] + (1 - alpha) * table[r, j])
+            table[r, j] = xyxy[i, j]
+
+@njit(cache=True)
+def table_rows(keys, track_ids, rows, fresh):
+    """Find or insert each track id in an open-addressing (linear probing) table.
+
+    Fills rows/fresh per id and returns how many ids were inserted. ByteTrack
+    ids are sequential, so the identity hash already spreads them.
+    """
+    mask = keys.shape[0] - 1
+    inserted = 0
+    for i in range(track_ids.shape[0]):
+        t = track_ids[i]
+        h = t & mask
+        while keys[h] != t and keys[h] != EMPTY_KEY:
+            h = (h + 1) & mask
+        fresh[i] = keys[h] == EMPTY_KEY
+        if fresh[i]:
+            keys[h] = t
+            inserted += 1
+        rows[i] = h
+    return inserted
+
+@njit(cache=True)
+def evict_stale(keys, table, last_seen, min_seen):
+    """Rehash the table keeping only rows seen at or after min_seen; returns the new size."""
+    old_keys = keys.copy()
+    old_table = table.copy()
+    old_seen = last_seen.copy()
+    keys[:] = EMPTY_KEY
+    mask = keys.shape[0] - 1
+    size = 0
+    for r in range(old_keys.shape[0]):
+        t = old_keys[r]
+        if t == EMPTY_KEY or old_seen[r] < min_seen:
+            continue
+        h = t & mask
+        while keys[h] != EMPTY_KEY:
+            h = (h + 1) & mask
+        keys[h] = t
+        table[h] = old_table[r]
+        last_seen[h] = old_seen[r]
+        size += 1
+    return size
+
+class TrackSmoother:
+    """Per-track EMA box smoothing over preallocated structure-of-arrays storage.
+
+    keys/table/last_seen form an open-addressing hash table keyed by track id,
+    so a frame's update allocates no per-box Python objects. Tracks unseen for
+    SMOOTHING_TTL frames are evicted when the table gets half full.
+    """
+
+    def __init__(self, max_tracks=MAX_TRACKS, alpha=SMOOTHING_ALPHA):
+        assert max_tracks & (max_tracks - 1) == 0, "max_tracks must be a power of two"
+        self.keys = np.full(max_tracks, EMPTY_KEY, dtype=np.int64)
+        self.table = np.zeros((max_tracks, 4), dtype=np.int32)
+        self.last_seen = np.zeros(max_tracks, dtype=np.int64)
+        self.size = 0
+        self.tick = 0
+        self.alpha = alpha
+
+    def update(self, track_ids, xyxy):
+        """Smooth one frame's int32 xyxy boxes in place."""
+        self.tick += 1
+        n = len(track_ids)
+        if 2 * (self.size + n) > len(self.keys):
+            self.size = evict_stale(self.keys, self.table, self.last_seen,
+                                    self.tick - SMOOTHING_TTL)
+            if 2 * (self.size + n) > len(self.keys):
+                self.keys.fill(EMPTY_KEY)
+                self.size = 0
+
+        rows = np.empty(n, dtype=np.int64)
+        fresh = np.empty(n, dtype=np.bool_)
+        self.size += table_rows(self.keys, track_ids, rows, fresh)
+        self.last_seen[rows] = self.tick
+        ema_update(self.table, rows, fresh, xyxy, self.alpha)
+
+_SOLID_PATCHES = {}
+
+def solid_patch(color, h, w):
+    """Return an h x w view of a cached solid-color image, growing it as needed."""
+    patch = _SOLID_PATCHES.get(color)
+    if patch is None or patch.shape[0] < h or patch.shape[1] < w:
+        ph = max(h, patch.shape[0] if patch is not None else 0)
+        pw = max(w, patch.shape[1] if patch is not None else 0)
+        patch = np.empty((ph, pw, 3), dtype=np.uint8)
+        patch[:] = color
+        _SOLID_PATCHES[color] = patch
+    return patch[:h, :w]
 
 def alpha_rect(img, p1, p2, color, alpha=LABEL_ALPHA):
     x1, y1 = p1
@@ -44,14 +260,35 @@ def alpha_rect(img, p1, p2, color, alpha=LABEL_ALPHA):
     x2 = min(img.shape[1] - 1, x2); y2 = min(img.shape[0] - 1, y2)
     if x2 <= x1 or y2 <= y1:
         return
-    overlay = img.copy()
-    cv2.rectangle(overlay, (x1, y1), (x2, y2), color, -1)
-    cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0, dst=img)
-
-def draw_box_with_label(img, box, label_text, box_color):
-    x1, y1, x2, y2 = box
-    cv2.rectangle(img, (x1, y1), (x2, y2), box_color, 2)
-    (tw, th), _ = cv2.getTextSize(label_text, FONT, FONT_SCALE, TEXT_THICK)
+    # Blend only the (inclusive) label rectangle instead of the whole frame
+    roi = img[y1:y2 + 1, x1:x2 + 1]
+    patch = solid_patch(color, roi.shape[0], roi.shape[1])
+    cv2.addWeighted(patch, alpha, roi, 1 - alpha, 0, dst=roi)
+
+@functools.lru_cache(maxsize=4096)
+def text_size(text):
+    """cv2.getTextSize for label text; labels only change when tracks appear."""
+    return cv2.getTextSize(text, FONT, FONT_SCALE, TEXT_THICK)[0]
+
+def draw_boxes_batch(img, xyxy, labels, colors):
+    """Draw all of a frame's boxes, then their labels.
+
+    Outlines of the same color go through one cv2.polylines call (the same
+    4-point polyline cv2.rectangle draws); labels are drawn on top.
+    """
+    if len(xyxy) == 0:
+        return
+    x1, y1, x2, y2 = xyxy.T
+    corners = np.stack([x1, y1, x2, y1, x2, y2, x1, y2], axis=1).reshape(-1, 4, 2)
+    for color in set(colors):
+        pts = [c for c, box_color in zip(corners, colors) if box_color == color]
+        cv2.polylines(img, pts, True, color, 2)
+
+    for (x1, y1, x2, y2), label_text, box_color in zip(xyxy.tolist(), labels, colors):
+        draw_label(img, x1, y1, label_text, box_color)
+
+def draw_label(img, x1, y1, label_text, box_color):
+    tw, th = text_size(label_text)
     top = max(0, y1 - th - 2 * PAD_Y)
     left = x1
     right = min(img.shape[1] - 1, x1 + tw + 2 * PAD_X)
@@ -60,6 +297,403 @@ def draw_box_with_label(img, box, label_text, box_color):
     cv2.putText(img, label_text, (left + PAD_X, bottom - PAD_Y),
                 FONT, FONT_SCALE, TEXT_COLOR, TEXT_THICK, cv2.LINE_AA)
 
+def letterbox_geometry(height, width, rect, stride, imgsz=IMGSZ):
+    """Resize size and padding Ultralytics' LetterBox uses for a frame size.
+
+    Returns (new_h, new_w, top, left, in_h, in_w). With rect=True the padding
+    is trimmed to a stride multiple (LetterBox(auto=True)) instead of imgsz.
+    """
+    r = min(imgsz / height, imgsz / width)
+    new_h, new_w = round(height * r), round(width * r)
+    dh, dw = imgsz - new_h, imgsz - new_w
+    if rect:
+        dh, dw = dh % stride, dw % stride
+    top, left = round(dh / 2 - 0.1), round(dw / 2 - 0.1)
+    return new_h, new_w, top, left, new_h + dh, new_w + dw
+
+class CpuPreprocessor:
+    """Letterbox BGR frames into a normalized RGB batch with fixed buffers.
+
+    The letterbox geometry is computed once for the video resolution and
+    frames are resized straight into a preallocated 114-padded canvas.
+    """
+
+    def __init__(self, height, width, rect, stride, imgsz=IMGSZ, batch=BATCH_SIZE):
+        self.new_h, self.new_w, self.top, self.left, in_h, in_w = letterbox_geometry(
+            height, width, rect, stride, imgsz)
+        self.canvas = np.full((batch, in_h, in_w, 3), 114, dtype=np.uint8)
+        self.out = torch.empty((batch, 3, in_h, in_w), dtype=torch.float32)
+
+    def __call__(self, frames):
+        n = len(frames)
+        for i, frame in enumerate(frames):
+            roi = self.canvas[i, self.top:self.top + self.new_h, self.left:self.left + self.new_w]
+            if frame.shape[:2] == roi.shape[:2]:
+                np.copyto(roi, frame)
+            else:
+                cv2.resize(frame, (self.new_w, self.new_h), dst=roi, interpolation=cv2.INTER_LINEAR)
+
+        # HWC uint8 BGR -> CHW float RGB in [0, 1]
+        out = self.out[:n]
+        out.copy_(torch.from_numpy(self.canvas[:n]).permute(0, 3, 1, 2).flip(1))
+        return out.div_(255)
+
+class GpuPreprocessor:
+    """Letterbox BGR frames into a normalized RGB batch on the GPU.
+
+    Buffers are sized once for the video resolution; frames are copied into
+    pinned host memory, uploaded on a side stream and resized on-device.
+    """
+
+    def __init__(self, height, width, rect, stride, imgsz=IMGSZ, batch=BATCH_SIZE,
+                 channels_last=False):
+        self.device = torch.device("cuda", 0)
+        self.stream = torch.cuda.Stream(self.device)
+        self.new_h, self.new_w, self.top, self.left, in_h, in_w = letterbox_geometry(
+            height, width, rect, stride, imgsz)
+
+        self.host = torch.empty((batch, height, width, 3), dtype=torch.uint8).pin_memory()
+        self.host_np = self.host.numpy()
+        self.gpu_bgr = torch.empty_like(self.host, device=self.device)
+        self.out = torch.full((batch, 3, in_h, in_w), 114 / 255,
+                              dtype=torch.float16, device=self.device)
+        if channels_last:
+            # Matches the PyTorch model's NHWC conv weights; TensorRT needs NCHW
+            self.out = self.out.contiguous(memory_format=torch.channels_last)
+
+    def __call__(self, frames):
+        n = len(frames)
+        for i, frame in enumerate(frames):
+            np.copyto(self.host_np[i], frame)
+
+        with torch.cuda.stream(self.stream):
+            gpu_bgr = self.gpu_bgr[:n]
+            gpu_bgr.copy_(self.host[:n], non_blocking=True)
+            # HWC uint8 BGR -> CHW float RGB in [0, 1]
+            x = gpu_bgr.permute(0, 3, 1, 2).flip(1).to(torch.float16).div_(255)
+            x = F.interpolate(x, size=(self.new_h, self.new_w),
+                              mode="bilinear", align_corners=False)
+            out = self.out[:n]
+            out[:, :, self.top:self.top + self.new_h, self.left:self.left + self.new_w] = x
+
+        torch.cuda.current_stream(self.device).wait_stream(self.stream)
+        return out
+
+class BackgroundWriter:
+    """Feed a video writer from a worker thread through a bounded queue.
+
+    Encoding one batch overlaps with inference on the next; OpenCV and pipe
+    writes release the GIL. Errors are re-raised on the next write()/close().
+    """
+
+    def __init__(self, writer, maxsize=WRITE_QUEUE_SIZE):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            if self.error is not None:
+                continue  # keep draining so the producer never blocks
+            try:
+                self.writer.write(frame)
+            except Exception as e:
+                self.error = e
+
+    def write(self, frame):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(frame)
+
+    def close(self):
+        """Wait for queued frames to be written and finalize the file."""
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+            if self.error is None:
+                try:
+                    self.writer.release()
+                except Exception as e:
+                    self.error = e
+        if self.error is not None:
+            raise self.error
+
+    def release(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+        try:
+            self.writer.release()
+        except Exception:
+            pass
+
+@functools.lru_cache(maxsize=None)
+def nvenc_available(ffmpeg):
+    """True if ffmpeg can actually open an NVENC session on this host."""
+    if not torch.cuda.is_available():
+        return False
+    probe = [ffmpeg, "-hide_banner", "-loglevel", "error",
+             "-f", "lavfi", "-i", "color=size=256x256", "-frames:v", "1",
+             *NVENC_ARGS, "-f", "null", "-"]
+    try:
+        return subprocess.run(probe, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL, timeout=30).returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+class FfmpegWriter:
+    """Pipe raw BGR frames to an ffmpeg H.264 encoder (cv2.VideoWriter-like API)."""
+
+    def __init__(self, path, fps, size, ffmpeg):
+        width, height = size
+        self.encoder_args = NVENC_ARGS if nvenc_available(ffmpeg) else X264_ARGS
+        cmd = [ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}",
+               "-r", f"{fps}", "-i", "-",
+               *self.encoder_args, "-pix_fmt", "yuv420p",
+               "-movflags", "+faststart"]
+        if width % 2 or height % 2:
+            # yuv420p needs even dimensions
+            cmd += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"]
+        self.proc = subprocess.Popen(cmd + [path], stdin=subprocess.PIPE)
+
+    @property
+    def encoder(self):
+        return self.encoder_args[1]
+
+    def isOpened(self):
+        return self.proc.poll() is None
+
+    def write(self, frame):
+        try:
+            self.proc.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError as e:
+            # ffmpeg exited early, e.g. it could not open the output path
+            raise IOError(f"ffmpeg exited with code {self.proc.wait()}") from e
+
+    def release(self):
+        if self.proc.stdin.closed:
+            return
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.proc.wait() != 0:
+            raise IOError(f"ffmpeg exited with code {self.proc.returncode}")
+
+def open_video_writer(path, fps, size):
+    """H.264 via ffmpeg when available, else OpenCV mp4v."""
+    ffmpeg = shutil.which(FFMPEG_BIN)
+    if ffmpeg is not None:
+        writer = FfmpegWriter(path, fps, size, ffmpeg)
+        logger.info("Encoding with ffmpeg (%s)", writer.encoder)
+        return writer
+    logger.warning("ffmpeg not found; encoding with OpenCV mp4v")
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(path, fourcc, fps, size)
+
+# PyAV reports display rotation in degrees counterclockwise
+_ROTATE_CODES = {
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    -90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    -180: cv2.ROTATE_180,
+}
+
+class VideoReader:
+    """Decode BGR frames with a cv2.VideoCapture-like read()/release() API.
+
+    Uses PyAV with frame-threaded decoding, on NVDEC when CUDA is available,
+    and falls back to cv2.VideoCapture when PyAV is not installed.
+    """
+
+    def __init__(self, path):
+        self.container = None
+        self.cap = None
+        self.pending = None
+
+        if av is None:
+            self.backend = "OpenCV"
+            self.cap = cv2.VideoCapture(path)
+            if not self.cap.isOpened():
+                raise IOError(f"Cannot open video: {path}")
+            self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            self.fps = float(self.cap.get(cv2.CAP_PROP_FPS) or 30.0)
+            return
+
+        if torch.cuda.is_available() and "cuda" in hwdevices_available():
+            try:
+                hwaccel = HWAccel("cuda", allow_software_fallback=True)
+                self.container = av.open(path, hwaccel=hwaccel)
+                self.backend = "PyAV (NVDEC)"
+            except Exception:
+                # e.g. the container lacks the NVIDIA "video" driver capability
+                self.container = None
+        if self.container is None:
+            self.container = av.open(path)
+            self.backend = "PyAV"
+        stream = self.container.streams.video[0]
+        stream.thread_type = "AUTO"
+        self.fps = float(stream.average_rate or 30.0)
+        self.frames = self.container.decode(stream)
+
+        # Peek one frame so width/height reflect any display rotation
+        ok, self.pending = self._decode_next()
+        if ok:
+            self.height, self.width = self.pending.shape[:2]
+        else:
+            self.width = stream.codec_context.width
+            self.height = stream.codec_context.height
+
+    def _decode_next(self):
+        frame = next(self.frames, None)
+        if frame is None:
+            return False, None
+        img = frame.to_ndarray(format="bgr24")
+        code = _ROTATE_CODES.get(frame.rotation)
+        if code is not None:
+            img = cv2.rotate(img, code)
+        return True, img
+
+    def read(self):
+        if self.cap is not None:
+            return self.cap.read()
+        if self.pending is not None:
+            img, self.pending = self.pending, None
+            return True, img
+        return self._decode_next()
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+        if self.container is not None:
+            self.container.close()
+
+class PrefetchReader:
+    """Decode frames ahead on a worker thread into a bounded queue.
+
+    Wraps a VideoReader with the same read()/release() API so demuxing and
+    decoding the next batch overlap with inference on the current one.
+    """
+
+    def __init__(self, reader, maxsize=PREFETCH_FRAMES):
+        self.reader = reader
+        self.backend = reader.backend
+        self.width = reader.width
+        self.height = reader.height
+        self.fps = reader.fps
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stop = threading.Event()
+        self.error = None
+        self.eof = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        try:
+            while True:
+                ok, frame = self.reader.read()
+                if not ok or not self._put(frame):
+                    break
+        except Exception as e:
+            self.error = e
+        self._put(None)
+
+    def read(self):
+        if self.eof:
+            return False, None
+        frame = self.queue.get()
+        if frame is None:
+            self.eof = True
+            if self.error is not None:
+                raise self.error
+            return False, None
+        return True, frame
+
+    def release(self):
+        self.stop.set()
+        self.thread.join()
+        self.reader.release()
+
+class BatchTracker:
+    """Persistent YOLO predictor and ByteTrack tracker, driven per batch.
+
+    model.track() re-merges arguments and re-checks the tracker YAML on every
+    call. Here the predictor is set up once by a warmup predict() and a single
+    BYTETracker is loaded from TRACKER_PATH; each batch then goes through
+    preprocess -> inference -> NMS and updates the tracker in frame order.
+    Preprocessing runs on the GPU when CUDA is available.
+    """
+
+    def __init__(self, model, extra_args, height, width):
+        # Same thresholds model.track() uses so ByteTrack sees low-conf boxes
+        model.predict(np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8), imgsz=IMGSZ,
+                      conf=TRACK_CONF, verbose=False, **extra_args)
+        self.predictor = model.predictor
+
+        # Input shape is fixed per video: PyTorch models take the minimal
+        # stride-aligned rectangle, TensorRT engines their square imgsz
+        rect = isinstance(model.model, torch.nn.Module)
+        stride = int(self.predictor.model.stride)
+        if torch.cuda.is_available():
+            self.preprocess = GpuPreprocessor(height, width, rect, stride,
+                                              channels_last=extra_args.get("half", False))
+        else:
+            self.preprocess = CpuPreprocessor(height, width, rect, stride)
+        cfg = IterableSimpleNamespace(**YAML.load(TRACKER_PATH))
+        self.tracker = BYTETracker(args=cfg)
+
+    def __call__(self, frames):
+        """Track a batch; returns one (N, 7) [x1, y1, x2, y2, id, conf, cls] array per frame."""
+        p = self.predictor
+        im = self.preprocess(frames)
+        im = im.half() if p.model.fp16 else im.float()
+        preds = p.inference(im)
+        dets = non_max_suppression(
+            preds, p.args.conf, p.args.iou, p.args.classes, p.args.agnostic_nms,
+            max_det=p.args.max_det, end2end=getattr(p.model, "end2end", False),
+        )
+
+        tracks_per_frame = []
+        for frame, det in zip(frames, dets):
+            det[:, :4] = ops.scale_boxes(im.shape[2:], det[:, :4], frame.shape)
+            tracks = self.tracker.update(Boxes(det[:, :6].cpu().numpy(), frame.shape[:2]), frame)
+            tracks = ops.clip_boxes(tracks[:, :-1], frame.shape) if len(tracks) else tracks
+            tracks_per_frame.append(tracks)
+        return tracks_per_frame
+
+def tracked_boxes(tracks):
+    """Split a tracks array into (ids, cls, xyxy, conf) arrays, or None if empty."""
+    if len(tracks) == 0:
+        return None
+    ids = tracks[:, 4].astype(np.int64)
+    keep = ids != -1
+    tracks = tracks[keep]
+    return (
+        ids[keep],
+        tracks[:, 6].astype(np.int64),
+        tracks[:, :4].astype(np.int32),
+        tracks[:, 5],
+    )
+
 def safe_class_name(class_id):
     return CLASS_NAMES[class_id] if 0 <= class_id < len(CLASS_NAMES) else str(class_id)
 
@@ -68,7 +702,7 @@ def ensure_model_downloaded():
     os.makedirs(MODEL_DIR, exist_ok=True)
 
     if os.path.exists(MODEL_PATH):
-        print(f"🔹 Model already present at {MODEL_PATH}", flush=True)
+        logger.info("Model already present at %s", MODEL_PATH)
         return
 
     model_url = os.environ.get("BELUGA_MODEL_URL")
@@ -78,7 +712,7 @@ def ensure_model_downloaded():
             "Set it on Render to a direct-download URL for best.pt."
         )
 
-    print(f"🔹 Downloading model from {model_url} to {MODEL_PATH} ...", flush=True)
+    logger.info("Downloading model from %s to %s ...", model_url, MODEL_PATH)
     resp = requests.get(model_url, stream=True)
     resp.raise_for_status()
 
@@ -89,7 +723,128 @@ def ensure_model_downloaded():
                 f.write(chunk)
 
     os.replace(tmp_path, MODEL_PATH)
-    print("✅ Model download complete.", flush=True)
+    logger.info("Model download complete.")
+
+@functools.lru_cache(maxsize=None)
+def weights_tag():
+    """Short content hash of best.pt, so replaced weights get a fresh engine."""
+    digest = hashlib.sha1()
+    with open(MODEL_PATH, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+def engine_cache_path(precision):
+    """Cache path for the engine built for these weights / GPU / TensorRT / imgsz / precision."""
+    import tensorrt as trt
+    major, minor = torch.cuda.get_device_capability(0)
+    name = (f"best-{weights_tag()}_sm{major}{minor}_trt{trt.__version__}"
+            f"_{IMGSZ}_b{BATCH_SIZE}_{precision}.engine")
+    return os.path.join(ENGINE_DIR, name)
+
+def write_calibration_data(video_path, calib_dir, n_frames=CALIB_FRAMES):
+    """Sample frames from video_path into an Ultralytics dataset YAML for INT8 calibration."""
+    images_dir = os.path.join(calib_dir, "images")
+    os.makedirs(images_dir, exist_ok=True)
+
+    reader = VideoReader(video_path)
+    saved = 0
+    idx = 0
+    try:
+        while saved < n_frames:
+            ok, frame = reader.read()
+            if not ok:
+                break
+            if idx % CALIB_STRIDE == 0:
+                cv2.imwrite(os.path.join(images_dir, f"{saved:05d}.jpg"), frame)
+                saved += 1
+            idx += 1
+    finally:
+        reader.release()
+    if saved == 0:
+        raise RuntimeError(f"no frames could be read from {video_path}")
+
+    yaml_path = os.path.join(calib_dir, "calib.yaml")
+    YAML.save(yaml_path, {
+        "path": calib_dir,
+        "train": "images",
+        "val": "images",
+        "names": dict(enumerate(CLASS_NAMES)),
+    })
+    logger.info("Wrote %d calibration frames to %s", saved, images_dir)
+    return yaml_path
+
+def ensure_engine(precision="fp16", calib_video=None):
+    """Export best.pt to a TensorRT engine once and return its path.
+
+    precision is "fp16" or "int8"; INT8 is calibrated on frames sampled
+    from calib_video when the engine is first built.
+    """
+    engine_path = engine_cache_path(precision)
+    if os.path.exists(engine_path):
+        logger.info("TensorRT engine already present at %s", engine_path)
+        return engine_path
+
+    if precision == "int8" and calib_video is None:
+        raise RuntimeError("INT8 export needs a video to calibrate on")
+
+    os.makedirs(ENGINE_DIR, exist_ok=True)
+    # export() writes best.onnx/best.engine next to the weights, so export
+    # from a private copy; concurrent first runs then never share those paths,
+    # and calibration frames are removed with the directory
+    with tempfile.TemporaryDirectory(dir=ENGINE_DIR) as work_dir:
+        weights = os.path.join(work_dir, "best.pt")
+        shutil.copyfile(MODEL_PATH, weights)
+        if precision == "int8":
+            calib_yaml = write_calibration_data(calib_video, os.path.join(work_dir, "calib"))
+            precision_args = {"int8": True, "data": calib_yaml}
+        else:
+            precision_args = {"half": True}
+
+        logger.info("Exporting TensorRT %s engine to %s ...", precision.upper(), engine_path)
+        exported = YOLO(weights).export(
+            format="engine", imgsz=IMGSZ, device=0,
+            dynamic=True, batch=BATCH_SIZE, workspace=4, **precision_args,
+        )
+        os.replace(exported, engine_path)
+    logger.info("TensorRT export complete.")
+    return engine_path
+
+def load_tracker(height, width, calib_video=None):
+    """Set up a BatchTracker on the best model that loads, falling back to best.pt.
+
+    Preference is INT8 (opt-in, SM 7.5+), then FP16, then the PyTorch weights.
+    YOLO() opens engines lazily, so each one is warmed up before it is chosen.
+    """
+    if USE_TENSORRT and torch.cuda.is_available():
+        precisions = ["fp16"]
+        if USE_INT8 and torch.cuda.get_device_capability(0) >= (7, 5):
+            precisions.insert(0, "int8")
+        for precision in precisions:
+            try:
+                model = YOLO(ensure_engine(precision, calib_video), task="detect")
+                return BatchTracker(model, track_args(model), height, width)
+            except Exception as e:
+                logger.warning("TensorRT %s engine unavailable (%s)", precision.upper(), e)
+        logger.info("Using %s", MODEL_PATH)
+
+    model = YOLO(MODEL_PATH)
+    if torch.cuda.is_available():
+        # FP16 + channels_last conv stack for Tensor Cores. Fuse Conv+BN first
+        # so Ultralytics doesn't rebuild contiguous FP32 weights later.
+        model.fuse()
+        model.model.half().to(memory_format=torch.channels_last)
+    return BatchTracker(model, track_args(model), height, width)
+
+def track_args(model):
+    """Extra model.track() arguments for the loaded model."""
+    if not torch.cuda.is_available() or not isinstance(model.model, torch.nn.Module):
+        return {}  # CPU, or a TensorRT engine with its precision baked in
+    args = {"device": 0, "half": True}
+    if "channels_last" in DEFAULT_CFG_DICT:
+        # Newer Ultralytics resets the memory format unless asked not to
+        args["channels_last"] = True
+    return args
 
 def main():
     # Expect: python beluga_track_server.py input_video.mp4 output_video.mp4 output_csv.csv
@@ -97,12 +852,17 @@ def main():
         print("Usage: python beluga_track_server.py <input_video> <output_video> <output_csv>", file=sys.stderr)
         sys.exit(1)
 
+    setup_logging()
+    if BATCH_SIZE < 1:
+        logger.error("BELUGA_BATCH_SIZE must be at least 1 (got %d)", BATCH_SIZE)
+        sys.exit(1)
+
     input_video = sys.argv[1]
     output_video = sys.argv[2]
     output_csv = sys.argv[3]
 
     if not os.path.exists(input_video):
-        print(f"❌ Input video does not exist: {input_video}", file=sys.stderr)
+        logger.error("Input video does not exist: %s", input_video)
         sys.exit(1)
 
     # Ensure output folders exist
@@ -113,136 +873,197 @@ def main():
     try:
         ensure_model_downloaded()
     except Exception as e:
-        print(f"❌ Failed to prepare model: {e}", file=sys.stderr)
+        logger.error("Failed to prepare model: %s", e)
         sys.exit(1)
 
     if not os.path.exists(TRACKER_PATH):
-        print(f"❌ Tracker config not found at {TRACKER_PATH}", file=sys.stderr)
+        logger.error("Tracker config not found at %s", TRACKER_PATH)
         sys.exit(1)
 
-    print("🔹 Loading YOLO model...", flush=True)
-    model = YOLO(MODEL_PATH)
-
-    print(f"🔹 Opening video: {input_video}", flush=True)
-    cap = cv2.VideoCapture(input_video)
-    if not cap.isOpened():
-        print(f"❌ Cannot open video: {input_video}", file=sys.stderr)
+    logger.info("Opening video: %s", input_video)
+    try:
+        cap = PrefetchReader(VideoReader(input_video))
+    except Exception as e:
+        logger.error("Cannot open video: %s (%s)", input_video, e)
         sys.exit(1)
 
-    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps    = cap.get(cv2.CAP_PROP_FPS) or 30.0
-    fps = float(fps)
+    width  = cap.width
+    height = cap.height
+    fps    = cap.fps
 
-    print(f"Video properties: {width}x{height} @ {fps:.2f} fps", flush=True)
+    logger.info("Video properties: %dx%d @ %.2f fps", width, height, fps)
+    if av is None:
+        logger.warning("PyAV unavailable (%s); decoding with OpenCV", _av_import_error)
+    else:
+        logger.info("Decoding with %s", cap.backend)
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    writer = cv2.VideoWriter(output_video, fourcc, fps, (width, height))
+    # Optionally render and encode at a lower resolution than the source
+    out_scale = 1.0
+    out_size = (width, height)
+    if 0 < OUTPUT_HEIGHT < height:
+        out_scale = OUTPUT_HEIGHT / height
+        out_size = (int(round(width * out_scale / 2)) * 2, OUTPUT_HEIGHT)
+        logger.info("Output resolution: %dx%d", *out_size)
+
+    # Rows are streamed to the CSV as they are produced and flushed
+    # periodically, instead of rewriting the whole file every checkpoint.
+    # Opened before the video writer so a bad path fails before ffmpeg starts.
+    try:
+        csv_fh = open(output_csv, "w", newline="", buffering=1 << 20)
+    except OSError as e:
+        logger.error("Could not open output CSV: %s (%s)", output_csv, e)
+        cap.release()
+        sys.exit(1)
+    csv_w = csv.writer(csv_fh, lineterminator="\n")
+    csv_w.writerow(CSV_COLUMNS)
+
+    writer = open_video_writer(output_video, fps, out_size)
     if not writer.isOpened():
-        print(f"❌ Could not open writer for output video: {output_video}", file=sys.stderr)
+        logger.error("Could not open writer for output video: %s", output_video)
         cap.release()
+        csv_fh.close()
         sys.exit(1)
+    writer = BackgroundWriter(writer)
 
+    read_idx = 0
     frame_idx = 0
-    smoothing_buffer = {}
-    tracking_rows = []
+    smoother = TrackSmoother()
+    overlay = None
+    ref_small = None
+    skipped = 0
 
     # limit frames so it doesn't run forever on big videos (tune this later)
     MAX_FRAMES = 300  # ~10s at 30fps
 
     try:
-        while True:
-            ok, frame = cap.read()
-            if not ok:
-                break
+        # Predictor, tracker and preprocessing buffers are set up once per video
+        logger.info("Loading YOLO model...")
+        tracker = load_tracker(height, width, calib_video=input_video)
+
+        done = False
+        while not done:
+            # Buffer up to BATCH_SIZE frames so YOLO sees them in one call
+            frames_buf = []
+            infer_flags = []
+            while len(frames_buf) < BATCH_SIZE:
+                ok, frame = cap.read()
+                if not ok:
+                    done = True
+                    break
 
-            frame_idx += 1
-            t_sec = frame_idx / fps
+                if read_idx + 1 > MAX_FRAMES:
+                    logger.info("Stopping early after %d frames.", MAX_FRAMES)
+                    done = True
+                    break
+                read_idx += 1
 
-            if frame_idx > MAX_FRAMES:
-                print(f"Stopping early after {MAX_FRAMES} frames.", flush=True)
+                # With skipping enabled, only run YOLO when the scene moved
+                # since the last inferred frame, or when MAX_SKIP frames in a
+                # row have been skipped
+                infer = True
+                if MAX_SKIP > 0:
+                    small = cv2.cvtColor(
+                        cv2.resize(frame, DIFF_SIZE, interpolation=cv2.INTER_AREA),
+                        cv2.COLOR_BGR2GRAY,
+                    )
+                    infer = (
+                        ref_small is None
+                        or skipped >= MAX_SKIP
+                        or float(np.mean(cv2.absdiff(small, ref_small))) >= SKIP_DIFF_THRESH
+                    )
+                    if infer:
+                        ref_small = small
+                        skipped = 0
+                    else:
+                        skipped += 1
+
+                # Debug overlay so you know this is processed video
+                cv2.putText(
+                    frame,
+                    f"Beluga tracking frame {read_idx}",
+                    (20, 30),
+                    FONT,
+                    0.7,
+                    (0, 0, 255),
+                    2,
+                    cv2.LINE_AA,
+                )
+                frames_buf.append(frame)
+                infer_flags.append(infer)
+
+            if not frames_buf:
                 break
 
-            # Debug overlay so you know this is processed video
-            cv2.putText(
-                frame,
-                f"Beluga tracking frame {frame_idx}",
-                (20, 30),
-                FONT,
-                0.7,
-                (0, 0, 255),
-                2,
-                cv2.LINE_AA,
-            )
-
-            # Run YOLO tracking
-            results = model.track(frame, persist=True, tracker=TRACKER_PATH)
-
-            if results:
-                for r in results:
-                    if not hasattr(r, 'boxes') or r.boxes is None or len(r.boxes) == 0:
-                        continue
-                    for box in r.boxes:
-                        class_id = int(box.cls[0]) if box.cls is not None else 0
-                        track_id = int(box.id[0])  if box.id is not None else -1
-                        if track_id == -1:
-                            continue
-
-                        x1, y1, x2, y2 = map(int, box.xyxy[0])
+            # Run YOLO on the frames that need it in one batch; the tracker
+            # is then updated frame by frame in order
+            infer_frames = [f for f, infer in zip(frames_buf, infer_flags) if infer]
+            results = tracker(infer_frames) if infer_frames else []
+            results_it = iter(results)
+
+            for frame, infer in zip(frames_buf, infer_flags):
+                frame_idx += 1
+                t_sec = frame_idx / fps
+
+                out_frame = frame
+                if out_scale != 1.0:
+                    out_frame = cv2.resize(frame, out_size, interpolation=cv2.INTER_AREA)
+
+                # Skipped frames redraw the last inferred frame's boxes; they
+                # are not smoothed again and get no CSV rows
+                if infer:
+                    overlay = None
+                    dets = tracked_boxes(next(results_it))
+                    if dets is not None:
+                        ids, cls, xyxy, conf = dets
 
                         # Smooth boxes per track id
-                        if track_id in smoothing_buffer:
-                            px1, py1, px2, py2 = smoothing_buffer[track_id]
-                            x1 = smooth(px1, x1); y1 = smooth(py1, y1)
-                            x2 = smooth(px2, x2); y2 = smooth(py2, y2)
-                        smoothing_buffer[track_id] = [x1, y1, x2, y2]
-
-                        whale_class = safe_class_name(class_id)
-                        beh_name = 'surfacing' if whale_class == 'Adult' else 'nursing'
-                        conf_val = float(box.conf[0]) if hasattr(box, "conf") and box.conf is not None else 0.0
-
-                        label_text = f"{whale_class} ID:{track_id}"
-                        box_color = CALF_BLUE if whale_class == "Calf" else ADULT_GREEN
-
-                        draw_box_with_label(frame, (x1, y1, x2, y2), label_text, box_color=box_color)
-
-                        tracking_rows.append([
-                            frame_idx, t_sec, track_id, whale_class,
-                            x1, y1, x2, y2, beh_name, conf_val
-                        ])
-
-            # write the annotated frame
-            writer.write(frame)
-
-            # Periodic CSV write
-            if frame_idx % CSV_EVERY_N_FRAMES == 0 and tracking_rows:
-                df = pd.DataFrame(
-                    tracking_rows,
-                    columns=["Frame", "Time (s)", "Track_ID", "Class",
-                             "X1", "Y1", "X2", "Y2", "Behavior", "Conf"]
-                )
-                df.to_csv(output_csv, index=False)
+                        smoother.update(ids, xyxy)
+                        draw_xyxy = xyxy if out_scale == 1.0 else (xyxy * out_scale).astype(np.int32)
+
+                        labels = []
+                        colors = []
+                        for track_id, class_id, (x1, y1, x2, y2), conf_val in zip(
+                                ids.tolist(), cls.tolist(), xyxy.tolist(), conf.tolist()):
+                            whale_class = safe_class_name(class_id)
+                            beh_name = 'surfacing' if whale_class == 'Adult' else 'nursing'
+
+                            label_text = f"{whale_class} ID:{track_id}"
+                            box_color = CALF_BLUE if whale_class == "Calf" else ADULT_GREEN
+
+                            labels.append(label_text)
+                            colors.append(box_color)
+
+                            csv_w.writerow([
+                                frame_idx, t_sec, track_id, whale_class,
+                                x1, y1, x2, y2, beh_name, conf_val
+                            ])
+                        overlay = (draw_xyxy, labels, colors)
+
+                if overlay is not None:
+                    draw_boxes_batch(out_frame, *overlay)
+
+                # write the annotated frame
+                writer.write(out_frame)
+
+                # Periodic CSV flush
+                if frame_idx % CSV_EVERY_N_FRAMES == 0:
+                    csv_fh.flush()
 
-            if frame_idx % 50 == 0:
-                print(f"Processed frame {frame_idx}...", flush=True)
+                if frame_idx % 50 == 0:
+                    logger.info("Processed frame %d...", frame_idx, extra={"buffered": True})
 
-        # Final CSV write
-        if tracking_rows:
-            df = pd.DataFrame(
-                tracking_rows,
-                columns=["Frame", "Time (s)", "Track_ID", "Class",
-                         "X1", "Y1", "X2", "Y2", "Behavior", "Conf"]
-            )
-            df.to_csv(output_csv, index=False)
+        csv_fh.close()
+        writer.close()
 
-        print("✅ Tracking complete.")
-        print(f"✅ Annotated video saved: {output_video}")
-        print(f"✅ Tracking CSV saved:   {output_csv}")
+        logger.info("Tracking complete.")
+        logger.info("Annotated video saved: %s", output_video)
+        logger.info("Tracking CSV saved:   %s", output_csv)
 
     except Exception as e:
-        print(f"❌ Error during tracking: {e}", file=sys.stderr)
+        logger.error("Error during tracking: %s", e)
         cap.release()
         writer.release()
+        csv_fh.close()
         sys.exit(1)
 
     cap.release()
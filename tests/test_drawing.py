@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+import pytest
+
+import beluga_track_server as bts
+
+H, W = 120, 160
+
+
+def full_frame_alpha_rect(img, p1, p2, color, alpha=bts.LABEL_ALPHA):
+    """The original copy-the-frame-and-blend alpha_rect, for comparison."""
+    x1, y1 = p1
+    x2, y2 = p2
+    x1 = max(0, x1); y1 = max(0, y1)
+    x2 = min(img.shape[1] - 1, x2); y2 = min(img.shape[0] - 1, y2)
+    if x2 <= x1 or y2 <= y1:
+        return
+    overlay = img.copy()
+    cv2.rectangle(overlay, (x1, y1), (x2, y2), color, -1)
+    cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0, dst=img)
+
+
+def random_frame(rng):
+    return rng.integers(0, 256, size=(H, W, 3), dtype=np.uint8)
+
+
+def test_alpha_rect_matches_full_frame_blend():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        x = np.sort(rng.integers(-40, W + 40, size=2))
+        y = np.sort(rng.integers(-40, H + 40, size=2))
+        color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        img = random_frame(rng)
+        expected = img.copy()
+
+        bts.alpha_rect(img, (x[0], y[0]), (x[1], y[1]), color)
+        full_frame_alpha_rect(expected, (x[0], y[0]), (x[1], y[1]), color)
+        assert np.array_equal(img, expected), (x, y)
+
+
+@pytest.mark.parametrize("p1, p2", [
+    ((0, 0), (W - 1, H - 1)),    # whole frame, inclusive corners
+    ((-10, -10), (5, 5)),        # clipped at the top-left
+    ((W - 6, H - 6), (W + 10, H + 10)),  # clipped at the bottom-right
+    ((20, 30), (21, 31)),        # 2x2, the smallest blended rectangle
+    ((20, 30), (20, 60)),        # zero width: nothing drawn
+])
+def test_alpha_rect_edges(p1, p2):
+    rng = np.random.default_rng(1)
+    img = random_frame(rng)
+    expected = img.copy()
+    bts.alpha_rect(img, p1, p2, (10, 200, 30))
+    full_frame_alpha_rect(expected, p1, p2, (10, 200, 30))
+    assert np.array_equal(img, expected)
+
+
+def draw_box_with_label(img, box, label_text, box_color):
+    """The original per-box cv2.rectangle + label drawing, for comparison."""
+    x1, y1, x2, y2 = box
+    cv2.rectangle(img, (x1, y1), (x2, y2), box_color, 2)
+    bts.draw_label(img, x1, y1, label_text, box_color)
+
+
+def test_draw_boxes_batch_matches_cv2_rectangle():
+    rng = np.random.default_rng(2)
+    for _ in range(200):
+        x = np.sort(rng.integers(-20, W + 20, size=2))
+        y = np.sort(rng.integers(-20, H + 20, size=2))
+        box = [int(x[0]), int(y[0]), int(x[1]), int(y[1])]
+        color = (bts.ADULT_GREEN, bts.CALF_BLUE)[rng.integers(2)]
+        img = random_frame(rng)
+        expected = img.copy()
+
+        bts.draw_boxes_batch(img, np.array([box], dtype=np.int32), ["Adult ID:7"], [color])
+        draw_box_with_label(expected, box, "Adult ID:7", color)
+        assert np.array_equal(img, expected), box
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import torch
+from ultralytics.data.augment import LetterBox
+from ultralytics.utils import ops
+
+import beluga_track_server as bts
+
+SIZES = [(360, 640), (720, 1280), (1080, 1920), (1920, 1080),
+         (480, 640), (640, 640), (333, 517), (2160, 3840),
+         (361, 640), (1080, 1917)]  # odd padding
+
+
+@pytest.mark.parametrize("height, width", SIZES)
+@pytest.mark.parametrize("rect", [True, False])
+def test_letterbox_geometry_matches_ultralytics_letterbox(height, width, rect):
+    new_h, new_w, top, left, in_h, in_w = bts.letterbox_geometry(height, width, rect, 32)
+
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    out = LetterBox((bts.IMGSZ, bts.IMGSZ), auto=rect, stride=32)(image=img)
+    assert out.shape[:2] == (in_h, in_w)
+
+    content = np.argwhere(out[..., 0] != 114)
+    (y0, x0), (y1, x1) = content.min(0), content.max(0)
+    assert (top, left, new_h, new_w) == (y0, x0, y1 - y0 + 1, x1 - x0 + 1)
+
+
+@pytest.mark.parametrize("height, width", SIZES)
+@pytest.mark.parametrize("rect", [True, False])
+def test_letterbox_geometry_inverts_through_scale_boxes(height, width, rect):
+    new_h, new_w, top, left, in_h, in_w = bts.letterbox_geometry(height, width, rect, 32)
+
+    # The resized frame's corners must map back onto the source frame's
+    boxes = torch.tensor([[left, top, left + new_w, top + new_h]], dtype=torch.float64)
+    boxes = ops.scale_boxes((in_h, in_w), boxes, (height, width))
+    assert boxes[0].tolist() == pytest.approx([0, 0, width, height])
+
+    # and an interior point lands where the resize put it
+    gain_x, gain_y = new_w / width, new_h / height
+    point = torch.tensor([[left + 10.0, top + 20.0, left + 30.0, top + 40.0]], dtype=torch.float64)
+    point = ops.scale_boxes((in_h, in_w), point, (height, width))
+    assert point[0].tolist() == pytest.approx([10 / gain_x, 20 / gain_y, 30 / gain_x, 40 / gain_y])
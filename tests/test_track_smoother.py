@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+import beluga_track_server as bts
+
+KERNELS = ["ema_update", "table_rows", "evict_stale"]
+
+
+@pytest.fixture(params=["njit", "python"])
+def kernels(request, monkeypatch):
+    """Run each test against the compiled kernels and their plain-Python bodies."""
+    if request.param == "python":
+        for name in KERNELS:
+            fn = getattr(bts, name)
+            monkeypatch.setattr(bts, name, getattr(fn, "py_func", fn))
+    return request.param
+
+
+def smooth(old, new, alpha=bts.SMOOTHING_ALPHA):
+    return int(alpha * new + (1 - alpha) * old)
+
+
+def dict_smooth(buffer, track_ids, xyxy):
+    """The original per-box smoothing_buffer loop, for comparison."""
+    out = []
+    for track_id, (x1, y1, x2, y2) in zip(track_ids.tolist(), xyxy.tolist()):
+        if track_id in buffer:
+            px1, py1, px2, py2 = buffer[track_id]
+            x1 = smooth(px1, x1); y1 = smooth(py1, y1)
+            x2 = smooth(px2, x2); y2 = smooth(py2, y2)
+        buffer[track_id] = [x1, y1, x2, y2]
+        out.append([x1, y1, x2, y2])
+    return np.array(out, dtype=np.int32).reshape(-1, 4)
+
+
+def lookup(keys, track_ids):
+    track_ids = np.asarray(track_ids, dtype=np.int64)
+    rows = np.empty(len(track_ids), dtype=np.int64)
+    fresh = np.empty(len(track_ids), dtype=np.bool_)
+    inserted = bts.table_rows(keys, track_ids, rows, fresh)
+    return rows.tolist(), fresh.tolist(), inserted
+
+
+def test_table_rows_insert_then_lookup(kernels):
+    keys = np.full(16, bts.EMPTY_KEY, dtype=np.int64)
+    rows, fresh, inserted = lookup(keys, [3, 5, 40])
+    assert fresh == [True, True, True] and inserted == 3
+    assert keys[rows].tolist() == [3, 5, 40]
+
+    again, fresh, inserted = lookup(keys, [40, 3])
+    assert again == [rows[2], rows[0]]
+    assert fresh == [False, False] and inserted == 0
+
+
+def test_table_rows_probes_past_the_end(kernels):
+    keys = np.full(8, bts.EMPTY_KEY, dtype=np.int64)
+    rows, fresh, _ = lookup(keys, [7, 15, 23])  # all hash to slot 7
+    assert rows == [7, 0, 1]
+    assert lookup(keys, [23])[0] == [1]
+
+
+def test_evict_stale_keeps_rows_seen_since_min_seen(kernels):
+    keys = np.full(8, bts.EMPTY_KEY, dtype=np.int64)
+    table = np.zeros((8, 4), dtype=np.int32)
+    last_seen = np.zeros(8, dtype=np.int64)
+    rows, _, _ = lookup(keys, [7, 15, 23, 2])
+    for i, r in enumerate(rows):
+        table[r] = i
+        last_seen[r] = [10, 4, 5, 9][i]
+
+    assert bts.evict_stale(keys, table, last_seen, 5) == 3
+    rows, fresh, _ = lookup(keys, [7, 23, 2])
+    assert fresh == [False, False, False]
+    assert table[rows, 0].tolist() == [0, 2, 3]
+    assert last_seen[rows].tolist() == [10, 5, 9]
+    assert lookup(keys, [15])[1] == [True]
+
+
+def tracked_ids(smoother):
+    return set(smoother.keys[smoother.keys != bts.EMPTY_KEY].tolist())
+
+
+@pytest.mark.parametrize("unseen, kept", [(bts.SMOOTHING_TTL, True),
+                                          (bts.SMOOTHING_TTL + 1, False)])
+def test_smoother_evicts_tracks_unseen_for_ttl(kernels, unseen, kept):
+    smoother = bts.TrackSmoother(max_tracks=16)
+    box = np.array([[100, 100, 200, 200]], dtype=np.int32)
+    smoother.update(np.array([9]), box.copy())  # always stale by the end
+    smoother.update(np.array([0]), box.copy())
+    for _ in range(unseen - 1):
+        smoother.update(np.array([1, 2]), np.repeat(box, 2, axis=0))
+
+    # Five new tracks would push the table past half full, so stale rows go
+    smoother.update(np.arange(3, 8), np.repeat(box, 5, axis=0))
+    assert tracked_ids(smoother) == {1, 2, 3, 4, 5, 6, 7} | ({0} if kept else set())
+    assert smoother.size == len(tracked_ids(smoother))
+
+    if kept:
+        row = np.flatnonzero(smoother.keys == 0)
+        assert smoother.table[row].tolist() == box.tolist()
+
+
+def test_smoother_resets_when_nothing_is_stale(kernels):
+    smoother = bts.TrackSmoother(max_tracks=4)
+    box = np.array([[10, 10, 20, 20], [30, 30, 40, 40]], dtype=np.int32)
+    smoother.update(np.array([0, 1]), box.copy())
+    out = box + 100
+    smoother.update(np.array([2, 3]), out)
+    assert (out == box + 100).all()
+    assert tracked_ids(smoother) == {2, 3}
+    assert smoother.size == 2
+
+
+def test_smoother_matches_dict_smoothing(kernels):
+    rng = np.random.default_rng(0)
+    smoother = bts.TrackSmoother()
+    buffer = {}
+    for frame in range(500):
+        ids = np.unique(rng.integers(frame // 5, frame // 5 + 30, size=12))
+        xyxy = rng.integers(0, 1920, size=(len(ids), 4)).astype(np.int32)
+        expected = dict_smooth(buffer, ids, xyxy)
+        smoother.update(ids, xyxy)
+        assert (xyxy == expected).all(), frame